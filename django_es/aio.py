@@ -0,0 +1,227 @@
+"""
+Asyncio variants of the `django_es.utils` helpers, built on the `elasticsearch-async` transport.
+
+Requires Python 3.6+ and the `elasticsearch-async` package. Database access (fetching and serializing model items)
+is run in a thread with `asgiref.sync.sync_to_async` when available, so it stays safe under async Django.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.query import QuerySet
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch_dsl.response import Response
+
+from .bulk import BulkBody, get_bulk_payload, process_bulk_response
+from .mappings import mapping
+from .utils import _get_compress, _send_index_updated, create_model_bulk_body
+
+try:
+    from elasticsearch_async import AsyncElasticsearch
+except ImportError:
+    AsyncElasticsearch = None
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    sync_to_async = None
+
+__all__ = ['get_async_client', 'update_index', 'delete_index_item', 'bulk_stream', 'search', 'hydrate']
+
+_async_client = None
+
+
+def get_async_client():
+    """
+    :return: the `ES_ASYNC_CLIENT` setting if defined, otherwise a cached `AsyncElasticsearch()`.
+    """
+    global _async_client
+
+    if hasattr(settings, 'ES_ASYNC_CLIENT'):
+        return settings.ES_ASYNC_CLIENT
+
+    if _async_client is None:
+        if AsyncElasticsearch is None:
+            raise ImproperlyConfigured('django_es.aio requires the elasticsearch-async package, '
+                                       'or an ES_ASYNC_CLIENT setting.')
+        _async_client = AsyncElasticsearch()
+    return _async_client
+
+
+async def _run_sync(func, *args):
+    if sync_to_async is not None:
+        return await sync_to_async(func)(*args)
+    return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+async def _send(client, payload, compress, raise_on_error):
+    client, payload = get_bulk_payload(client, payload, compress)
+    resp = await client.transport.perform_request('POST', '/_bulk', body=payload)
+    return process_bulk_response(resp, raise_on_error)
+
+
+async def bulk_stream(bodies, client=None, concurrency=4, compress=False, raise_on_error=True):
+    """
+    Sends bulk bodies as they are produced, with at most `concurrency` bulk requests in flight.
+    :param bodies: an async iterable of bulk bodies, as bytes returned by `BulkBody.getvalue`.
+    :param client: async elasticsearch client, defaults to `get_async_client()`.
+    :param concurrency: maximum number of concurrent bulk requests. Defaults to 4.
+    :param compress: a boolean telling whether the bodies are gzip compressed. Defaults to False.
+    :param raise_on_error: raise `BulkIndexError` containing the failed items when some occur. Defaults to True.
+    :return: the list of (ok, item) tuples of the responses, in the order of the bodies.
+    """
+    client = client or get_async_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async def send(payload):
+        try:
+            return await _send(client, payload, compress, raise_on_error)
+        finally:
+            semaphore.release()
+
+    try:
+        async for payload in bodies:
+            await semaphore.acquire()
+            # stop producing bodies as soon as a request failed
+            for task in tasks:
+                if task.done() and task.exception() is not None:
+                    raise task.exception()
+            tasks.append(asyncio.ensure_future(send(payload)))
+        chunks = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(bodies, 'aclose'):
+            await bodies.aclose()
+        raise
+
+    results = []
+    for chunk_results in chunks:
+        results.extend(chunk_results)
+    return results
+
+
+async def update_index(model_items, model, action='index', bulk_size=100, refresh=True, compress=None, concurrency=4,
+                       client=None):
+    """
+    Async version of `django_es.utils.update_index`: model_items are fetched and serialized in a thread, chunk by
+    chunk, while up to `concurrency` bulk requests are in flight.
+    :param model_items: a list of model_items (or a queryset) which are to be indexed/updated, or primary keys if
+    action is 'delete'. A queryset is streamed by chunks of `bulk_size` rows: unordered querysets in primary key
+    order, ordered ones in their own order, by offset. An unordered sliced queryset is fetched at once.
+    :param model: Model that will get the index index instances related (i.e indices).
+    :param action: the action that you'd like to perform on this group of data. Must be in ('index', 'delete') and
+    defaults to 'index.'
+    :param bulk_size: bulk size for indexing. Defaults to 100.
+    :param refresh: a boolean that determines whether to refresh the indices once over. Defaults to True.
+    :param compress: a boolean that determines whether bulk bodies are gzip compressed. Defaults to the
+    `BULK_COMPRESS` setting of `DJANGO_ES`, or False.
+    :param concurrency: maximum number of concurrent bulk requests. Defaults to 4.
+    :param client: async elasticsearch client, defaults to `get_async_client()`.
+    """
+    client = client or get_async_client()
+    compress = _get_compress(compress)
+    sliced = isinstance(model_items, QuerySet) and \
+        (model_items.query.low_mark or model_items.query.high_mark is not None)
+    if not isinstance(model_items, QuerySet):
+        model_items = list(model_items)
+    elif sliced and not model_items.ordered:
+        # offsets within an unordered slice are not stable, the slice bounds the rows fetched at once
+        model_items = await _run_sync(list, model_items)
+    # keyset pagination, so each chunk is a cheap query whatever its position, unless it would change the rows or the
+    # order asked for
+    keyset = isinstance(model_items, QuerySet) and not model_items.ordered and not sliced
+    targets = set()
+
+    def fetch(start, last_pk):
+        if not keyset:
+            return list(model_items[start:start + bulk_size])
+        chunk = model_items.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        return list(chunk[:bulk_size])
+
+    def build(start, last_pk):
+        chunk = fetch(start, last_pk)
+        body = BulkBody(compress=compress)
+        targets.update(create_model_bulk_body(model, chunk, action, body))
+        last_pk = chunk[-1].pk if chunk and keyset else None
+        return len(chunk), last_pk, body.getvalue() if len(body) else None
+
+    async def bodies():
+        start, last_pk = 0, None
+        while True:
+            count, last_pk, payload = await _run_sync(build, start, last_pk)
+            if payload is not None:
+                yield payload
+            if count < bulk_size:
+                break
+            start += count
+
+    logging.info('{} documents of model {}.'.format(action, model.__name__))
+    results = await bulk_stream(bodies(), client, concurrency, compress)
+
+    if refresh and targets:
+        await client.indices.refresh(index=','.join(sorted(set(index_name for _, index_name in targets))))
+
+    for index_instance, index_name in targets:
+        _send_index_updated(index_instance, [index_name])
+    return results
+
+
+async def delete_index_item(item, model, refresh=True, client=None):
+    """
+    Async version of `django_es.utils.delete_index_item`.
+    """
+    client = client or get_async_client()
+    index_instances = mapping.get_index_instances(model)
+    index_names = await _run_sync(lambda: [mapping.resolve_index(index_instance)
+                                           for index_instance in index_instances])
+
+    for index_instance, index_name in zip(index_instances, index_names):
+        item_es_id = getattr(item, index_instance.id_field)
+        try:
+            await client.delete(index_name, index_instance.doc_type, item_es_id,
+                                routing=index_instance.get_routing(item))
+        except NotFoundError as e:
+            logging.warning(
+                'NotFoundError: could not delete {}.{} from index {}: {}.'.format(model.__name__, item_es_id,
+                                                                                  index_name, str(e)))
+
+    if refresh:
+        await client.indices.refresh(index=','.join(sorted(set(index_names))), ignore_unavailable=True)
+
+    for index_instance, index_name in zip(index_instances, index_names):
+        _send_index_updated(index_instance, [index_name])
+
+
+async def search(s, client=None, routing=None):
+    """
+    Executes an elasticsearch_dsl `Search` with the async client.
+    :param routing: routing value restricting the search to the shard of the routed documents. Optional.
+    :return: the elasticsearch_dsl `Response`.
+    """
+    client = client or get_async_client()
+    if routing is not None:
+        s = s.params(routing=routing)
+    resp = await client.search(index=s._index, doc_type=s._doc_type, body=s.to_dict(), **s._params)
+    return Response(s, resp)
+
+
+async def hydrate(response, model):
+    """
+    Fetches the model instances of the hits of a response with a single query.
+    :return: the list of model instances, in the order of the hits. Hits without a matching row are skipped.
+    """
+    id_field = mapping.get_index_instance(model).id_field
+    ids = [hit.meta.id for hit in response]
+
+    def fetch():
+        return dict((str(getattr(obj, id_field)), obj)
+                    for obj in model.objects.filter(**{'{}__in'.format(id_field): ids}))
+
+    objs = await _run_sync(fetch)
+    return [objs[pk] for pk in ids if pk in objs]
@@ -0,0 +1,157 @@
+import json
+from gzip import GzipFile
+from io import BytesIO
+from operator import methodcaller
+
+import six
+from elasticsearch.helpers import BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+
+from django_es import es_instance
+
+__all__ = ['BulkBody', 'bulk_ndjson']
+
+# cache of clients sending gzip encoded bodies, one per client
+_gzip_clients = {}
+
+
+class BulkBody(object):
+    """
+    NDJSON body for the elasticsearch `_bulk` endpoint.
+
+    Each action and document is encoded once, straight into a bytes buffer which is reused between requests,
+    instead of going through `elasticsearch.helpers.expand_action` and the transport serializer.
+    The buffer can optionally be gzip compressed.
+    """
+
+    def __init__(self, compress=False, compresslevel=6):
+        self.compress = compress
+        self.compresslevel = compresslevel
+        self._buffer = BytesIO()
+        self.reset()
+
+    def reset(self):
+        """
+        Empties the body so the buffer can be reused for the next request.
+        """
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._stream = GzipFile(fileobj=self._buffer, mode='wb', compresslevel=self.compresslevel) \
+            if self.compress else self._buffer
+        self._closed = False
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _write(self, line):
+        if isinstance(line, six.text_type):
+            line = line.encode('utf-8')
+        self._stream.write(line)
+        self._stream.write(b'\n')
+
+    def add(self, action, metadata, source=None):
+        """
+        Appends an action to the body.
+        :param action: one of 'index', 'create', 'update' or 'delete'.
+        :param metadata: dictionary of the action metadata (`_index`, `_type`, `_id`...).
+        :param source: pre-encoded JSON document, as returned by `ModelIndex.encode_object`. Ignored for 'delete'.
+        """
+        if self._closed:
+            raise ValueError('Cannot add an action to a bulk body which has already been read, reset it first.')
+
+        self._write(json.dumps({action: metadata}))
+        if action != 'delete':
+            self._write(source)
+        self.count += 1
+
+    def getvalue(self):
+        """
+        :return: the bytes to send, gzip compressed if `compress` is set.
+        """
+        if self.compress and not self._closed:
+            self._stream.close()
+        self._closed = True
+        return self._buffer.getvalue()
+
+
+class _BytesSerializer(JSONSerializer):
+    """
+    Passes pre-encoded bytes through, instead of serializing them as JSON.
+    """
+
+    def dumps(self, data):
+        if isinstance(data, six.binary_type):
+            return data
+        return super(_BytesSerializer, self).dumps(data)
+
+
+def _get_gzip_client(client):
+    """
+    Elasticsearch connections send the same headers with every request, so compressed bodies are sent through a
+    dedicated client, built from the given one, which announces gzip content.
+    """
+    key = id(client)
+    if key not in _gzip_clients:
+        transport = client.transport
+        kwargs = transport.kwargs.copy()
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update({'content-encoding': 'gzip', 'content-type': 'application/x-ndjson'})
+        # options consumed by `Transport.__init__`, which are not kept in `transport.kwargs`
+        for option in ('connection_class', 'connection_pool_class', 'host_info_callback', 'max_retries',
+                       'retry_on_status', 'retry_on_timeout', 'send_get_body_as', 'sniffer_timeout', 'sniff_timeout',
+                       'sniff_on_connection_fail'):
+            if hasattr(transport, option):
+                kwargs[option] = getattr(transport, option)
+        _gzip_clients[key] = client.__class__(list(transport.hosts), transport_class=transport.__class__, headers=headers,
+                                              serializer=_BytesSerializer(), **kwargs)
+    return _gzip_clients[key]
+
+
+def bulk_ndjson(body, client=None, raise_on_error=True, **params):
+    """
+    Sends a `BulkBody` to elasticsearch as a single request.
+    :param body: the `BulkBody` to send.
+    :param client: elasticsearch client, defaults to `es_instance`.
+    :param raise_on_error: raise `BulkIndexError` containing the failed items when some occur. Defaults to True.
+    :param params: query parameters of the bulk request, such as `refresh`.
+    :return: the list of (ok, item) tuples of the response, in the order of the actions of the body.
+    """
+    client = client or es_instance
+    if not len(body):
+        return []
+
+    client, payload = get_bulk_payload(client, body.getvalue(), body.compress)
+    resp = client.transport.perform_request('POST', '/_bulk', params=params, body=payload)
+    return process_bulk_response(resp, raise_on_error)
+
+
+def get_bulk_payload(client, payload, compress):
+    """
+    :return: the client to send the bytes of a bulk body with, and the payload it expects.
+    """
+    if compress:
+        return _get_gzip_client(client), payload
+    if six.PY3:
+        # the transport serializer only passes text through
+        return client, payload.decode('utf-8')
+    return client, payload
+
+
+def process_bulk_response(resp, raise_on_error=True):
+    """
+    :return: the list of (ok, item) tuples of a bulk response, raising `BulkIndexError` on failed items if
+    `raise_on_error` is set.
+    """
+    results = []
+    errors = []
+    for op_type, item in map(methodcaller('popitem'), resp['items']):
+        ok = 200 <= item.get('status', 500) < 300
+        if not ok:
+            errors.append({op_type: item})
+        results.append((ok, {op_type: item}))
+
+    if errors and raise_on_error:
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+    return results
@@ -0,0 +1,208 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import tempfile
+from gzip import GzipFile
+
+from django_es import es_instance
+from .bulk import BulkBody, bulk_ndjson
+from .mappings import mapping
+from .signals.documents import index_updated
+
+__all__ = ['extract_index', 'load_index']
+
+SEGMENT_SUFFIX = '.ndjson.gz'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+class SegmentWriter(object):
+    """
+    Writes bulk actions to compressed NDJSON segment files named `<prefix>.<number>.ndjson.gz`, starting a new segment
+    every `segment_size` actions. A segment only gets its final name once complete.
+    """
+
+    def __init__(self, directory, prefix, segment_size=10000, compresslevel=1):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.compresslevel = compresslevel
+        self.segments = []
+        self._file = None
+        self._count = 0
+
+    def _open(self):
+        self._tmp_path = os.path.join(self.directory, '.{}.{:06d}.tmp'.format(self.prefix, len(self.segments)))
+        self._file = GzipFile(self._tmp_path, mode='wb', compresslevel=self.compresslevel)
+        self._count = 0
+
+    def write(self, metadata, source):
+        if self._file is None:
+            self._open()
+        self._file.write(json.dumps({'index': metadata}).encode('utf-8') + b'\n')
+        self._file.write(source.encode('utf-8') + b'\n')
+        self._count += 1
+        if self._count >= self.segment_size:
+            self.close()
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        path = os.path.join(self.directory, '{}.{:06d}{}'.format(self.prefix, len(self.segments), SEGMENT_SUFFIX))
+        os.rename(self._tmp_path, path)
+        self.segments.append(path)
+        self._file = None
+
+
+def extract_index(model, directory, chunk_size=500, segment_size=10000, compresslevel=1):
+    """
+    First phase of a two-phase reindex: serializes all the rows of a model to local segment files, without waiting on
+    elasticsearch, so the database cursor is held only as long as the serialization takes.
+    One series of segments is written for each index instance registered for the model, each row being serialized
+    once for all of them.
+    :param model: Model whose rows are extracted.
+    :param directory: directory where segments are written, it is created if needed. Segments of a previous extraction
+    are removed.
+    :param chunk_size: number of rows serialized at once. Defaults to 500.
+    :param segment_size: number of documents per segment file. Defaults to 10000.
+    :param compresslevel: gzip compression level of the segments. Defaults to 1, favoring speed.
+    :return: the list of the segment files written.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # a new extraction replaces the previous one, whose segments could hold deleted rows or former index names, and is
+    # loaded from scratch
+    for pattern in ('*' + SEGMENT_SUFFIX, '.*.tmp', CHECKPOINT_FILE):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            os.remove(path)
+
+    index_instances = mapping.get_index_instances(model)
+    writers = []
+    for index_instance in index_instances:
+        index_name = mapping.resolve_index(index_instance)
+        prefix = '{}.{}'.format(index_name, index_instance.doc_type)
+        writers.append((index_instance, index_name, SegmentWriter(directory, prefix, segment_size, compresslevel)))
+
+    def write_chunk(chunk):
+        cache = {}
+        for index_instance, index_name, writer in writers:
+            docs = [doc for doc in chunk if index_instance.matches_indexing_condition(doc)]
+            for doc, serialized_object in zip(docs, index_instance.serialize_objects(docs, cache)):
+                metadata = {'_index': index_name, '_type': index_instance.doc_type,
+                            '_id': str(getattr(doc, index_instance.id_field))}
+                routing = index_instance.get_routing(doc)
+                if routing is not None:
+                    metadata['_routing'] = routing
+                writer.write(metadata, index_instance.encode_object(doc, serialized_object=serialized_object))
+
+    logging.info('Extracting documents of model {} to {}.'.format(model.__name__, directory))
+    chunk = []
+    for item in model.objects.order_by('pk').iterator():
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            write_chunk(chunk)
+            chunk = []
+    if chunk:
+        write_chunk(chunk)
+
+    segments = []
+    for _, _, writer in writers:
+        writer.close()
+        segments.extend(writer.segments)
+    return segments
+
+
+def _read_checkpoint(directory):
+    """
+    :return: a dictionary of target -> list of the loaded segments.
+    """
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+            return json.load(f)
+    except (IOError, OSError):
+        return {}
+
+
+def _write_checkpoint(directory, checkpoint):
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(checkpoint, f)
+    os.rename(tmp_path, os.path.join(directory, CHECKPOINT_FILE))
+
+
+def _get_target(client, index):
+    """
+    :return: the checkpoint key of a load, segments being loaded once per cluster and index override.
+    """
+    return json.dumps({'hosts': client.transport.hosts, 'index': index}, sort_keys=True)
+
+
+def _get_index_class(doc_type):
+    for index_instances in mapping._registry.values():
+        for index_instance in index_instances:
+            if index_instance.doc_type == doc_type:
+                return index_instance.__class__
+    return None
+
+
+def load_index(directory, index=None, bulk_size=500, client=None, refresh=True, compress=False):
+    """
+    Second phase of a two-phase reindex: bulk loads the segment files written by `extract_index`.
+    Segments are memory-mapped and read sequentially. Each loaded segment is recorded in a checkpoint file of the
+    directory, per cluster and index override, so a crashed load resumes with the first segment not entirely loaded,
+    while the same segments can still be loaded into another index or cluster.
+    :param directory: directory containing the segments.
+    :param index: index name overriding the one recorded in the segments, e.g. to seed another cluster.
+    :param bulk_size: number of documents per bulk request. Defaults to 500.
+    :param client: elasticsearch client, defaults to `es_instance`.
+    :param refresh: a boolean that determines whether to refresh the loaded indices once over. Defaults to True.
+    :param compress: a boolean that determines whether bulk bodies are gzip compressed. Defaults to False.
+    """
+    client = client or es_instance
+    checkpoint = _read_checkpoint(directory)
+    target = _get_target(client, index)
+    loaded = set(checkpoint.get(target, []))
+    # (doc type, index name) of the loaded documents
+    targets = set()
+    body = BulkBody(compress=compress)
+
+    for path in sorted(glob.glob(os.path.join(directory, '*' + SEGMENT_SUFFIX))):
+        segment = os.path.basename(path)
+        if segment in loaded:
+            logging.info('Segment {} already loaded, skipping.'.format(segment))
+            continue
+
+        logging.info('Loading segment {}.'.format(segment))
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                stream = GzipFile(fileobj=mapped, mode='rb')
+                while True:
+                    action_line = stream.readline()
+                    if not action_line:
+                        break
+                    metadata = json.loads(action_line.decode('utf-8'))['index']
+                    if index is not None:
+                        metadata['_index'] = index
+                    targets.add((metadata['_type'], metadata['_index']))
+                    body.add('index', metadata, stream.readline().rstrip(b'\n'))
+                    if len(body) >= bulk_size:
+                        bulk_ndjson(body, client=client, raise_on_error=True)
+                        body.reset()
+                if len(body):
+                    bulk_ndjson(body, client=client, raise_on_error=True)
+                    body.reset()
+            finally:
+                mapped.close()
+
+        loaded.add(segment)
+        checkpoint[target] = sorted(loaded)
+        _write_checkpoint(directory, checkpoint)
+
+    if refresh and targets:
+        client.indices.refresh(index=','.join(sorted(set(index_name for _, index_name in targets))))
+
+    for doc_type, index_name in sorted(targets):
+        index_updated.send(sender=_get_index_class(doc_type), doc_type=doc_type, index=index_name)
@@ -1,5 +1,9 @@
-from datetime import date, datetime
+import json
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from dateutil import parser
+import six
 from elasticsearch_dsl import Field
 from elasticsearch_dsl.field import InnerObject, ValidationException
 from django.template import Context, loader
@@ -26,24 +30,53 @@ class AbstractField(Field):
         self._model_attr = kwargs.pop('_model_attr', None)
         self._eval_func = kwargs.pop('_eval_as', None)
         self._template_name = kwargs.pop('_template', None)
+        self._template = None
         super(AbstractField, self).__init__(*args, **kwargs)
 
+    def get_template(self):
+        """
+        Loads and compiles the `_template` of this field on first use, then reuses it.
+        """
+        if self._template is None:
+            self._template = loader.select_template([self._template_name])
+        return self._template
+
+    def render_many(self, objs):
+        """
+        Renders the `_template` of this field for each of the given objects, reusing a single context.
+        :param objs: list of object instances, as dictionaries or as model instances.
+        :return: the list of rendered values, in the same order.
+        """
+        template = self.get_template()
+        # templates from the django backend wrap a `django.template.Template` which can be rendered with a `Context`
+        base_template = getattr(template, 'template', None)
+        if base_template is None:
+            return [template.render({'object': obj}) for obj in objs]
+
+        # same options as the backend rendering used by `value`
+        context = Context(autoescape=getattr(template.backend.engine, 'autoescape', True))
+        rendered = []
+        for obj in objs:
+            with context.push(object=obj):
+                rendered.append(base_template.render(context))
+        return rendered
+
     def value(self, obj):
         """
         Computes the value of this field to update the index.
         :param obj: object instance, as a dictionary or as a model instance.
         """
         if self._template_name:
-            t = loader.select_template([self._template_name])
-            return t.render(Context({'object': obj}))
+            return self.get_template().render({'object': obj})
 
         if self._eval_func:
             try:
                 return eval(self._eval_func)
             except Exception as e:
                 raise type(e)(
-                    'Could not compute value of {} field (_eval_as=`{}`): {}.'.format(unicode(self), self._eval_func,
-                                                                                      unicode(e)))
+                    'Could not compute value of {} field (_eval_as=`{}`): {}.'.format(six.text_type(self),
+                                                                                      self._eval_func,
+                                                                                      six.text_type(e)))
 
         elif self._model_attr:
             if isinstance(obj, dict):
@@ -59,7 +92,58 @@ class AbstractField(Field):
             raise KeyError(
                 '{0} gets its value via a model attribute, an eval function, a template, or is prepared in a method '
                 'call but none of `_model_attr`, `_eval_as,` `_template,` `prepare_{0}` is provided.'.format(
-                    unicode(self)))
+                    six.text_type(self)))
+
+    def encode(self, data):
+        """
+        Encodes a serialized value of this field as a JSON fragment.
+        Lists are encoded item by item, other values are handed to the type-specialized `_encode` method.
+        :param data: value as returned by `value` or by a `prepare_%s` method.
+        """
+        if data is None:
+            return 'null'
+        if isinstance(data, (list, tuple)):
+            return '[%s]' % ','.join([self.encode(item) for item in data])
+        return self._encode(data)
+
+    def _encode(self, data):
+        return json_encode(data)
+
+
+def _json_default(data):
+    if isinstance(data, (date, datetime)):
+        return data.isoformat()
+    elif isinstance(data, Decimal):
+        return float(data)
+    elif isinstance(data, timedelta):
+        return data.total_seconds()
+    elif isinstance(data, uuid.UUID):
+        return str(data)
+    raise TypeError('Unable to serialize %r (type: %s)' % (data, type(data)))
+
+
+def json_encode(data):
+    """
+    Generic JSON encoder, used for fields without a type-specialized encoder.
+    Handles `date`, `datetime`, `Decimal`, `timedelta` and `UUID` values.
+    """
+    return json.dumps(data, default=_json_default)
+
+
+class _FloatEncoder(object):
+
+    def _encode(self, data):
+        if isinstance(data, (float, Decimal) + six.integer_types) and not isinstance(data, bool):
+            return repr(float(data))
+        return super(_FloatEncoder, self)._encode(data)
+
+
+class _IntegerEncoder(object):
+
+    def _encode(self, data):
+        if isinstance(data, six.integer_types):
+            return '%d' % data
+        return super(_IntegerEncoder, self)._encode(data)
 
 
 # Redefine Elasticsearch dsl fields for our needs
@@ -96,6 +180,11 @@ class Date(AbstractField):
         except Exception as e:
             raise ValidationException('Could not parse date from the value (%r)' % data, e)
 
+    def _encode(self, data):
+        if isinstance(data, date):
+            return '"%s"' % data.isoformat()
+        return super(Date, self)._encode(data)
+
 
 class String(AbstractField):
     _param_defs = {
@@ -149,32 +238,37 @@ class Boolean(AbstractField):
             raise ValidationException("Value required for this field.")
         return data
 
+    def _encode(self, data):
+        if isinstance(data, bool):
+            return 'true' if data else 'false'
+        return json_encode(data)
+
 
-class Float(AbstractField):
+class Float(_FloatEncoder, AbstractField):
     name = 'float'
 
 
-class HalfFloat(AbstractField):
+class HalfFloat(_FloatEncoder, AbstractField):
     name = 'half_float'
 
 
-class Double(AbstractField):
+class Double(_FloatEncoder, AbstractField):
     name = 'double'
 
 
-class Byte(AbstractField):
+class Byte(_IntegerEncoder, AbstractField):
     name = 'byte'
 
 
-class Short(AbstractField):
+class Short(_IntegerEncoder, AbstractField):
     name = 'short'
 
 
-class Integer(AbstractField):
+class Integer(_IntegerEncoder, AbstractField):
     name = 'integer'
 
 
-class Long(AbstractField):
+class Long(_IntegerEncoder, AbstractField):
     name = 'long'
 
 
@@ -1,10 +1,16 @@
 import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from django.utils import timezone
+from elasticsearch.helpers import BulkIndexError
 from elasticsearch_dsl import Field, Mapping
 
-from six import iteritems
+from six import iteritems, text_type
 
 from .signals import get_signal_processor
-from .fields import django_field_to_index, String
+from .fields import django_field_to_index, json_encode, String
 
 
 class ModelIndex(object):
@@ -19,9 +25,12 @@ class ModelIndex(object):
     1. Create a class which inherits from ModelIndex.
     2. Define custom indexed fields as class attributes. Values must be instances Field. Important info in 3b.
     3. Define a `Meta` subclass, which must contain at least `model` as a class attribute.
-        a. Optional class attributes: `fields`, `excludes` and `additional_fields`.
+        a. Optional class attributes: `fields`, `excludes`, `additional_fields`, `index_period`, `index_template`,
+        `index_cache_size`, `modification_field` and `routing_field`.
         b. If custom indexed field requires model attributes which are not in the difference between `fields` and
         `excludes`, these must be defined in `additional_fields`.
+    4. Register it for a model. Several ModelIndex classes can be registered for the same model, each document then
+    being serialized once and routed to the indices whose `matches_indexing_condition` accepts it.
     """
 
     def __init__(self, model, *args):
@@ -42,16 +51,25 @@ class ModelIndex(object):
 
         self.fields = {}
         self.index = getattr(_meta, 'index', 'django_es')
-        self.indexes = [self.populate_index()]
+        self.index_period = getattr(_meta, 'index_period', None)
+        self.index_template = getattr(_meta, 'index_template', None)
+        self._index_name = None
+        self._index_name_expires = 0
+        # known index names, the oldest ones are evicted
+        self.indexes = deque([self.get_index_name()], maxlen=getattr(_meta, 'index_cache_size', 10))
         fields = getattr(_meta, 'fields', [])
         excludes = getattr(_meta, 'exclude', [])
         hotfixes = getattr(_meta, 'hotfixes', {})
         additional_fields = getattr(_meta, 'additional_fields', [])
         self.id_field = getattr(_meta, 'id_field', 'pk')
+        self.modification_field = getattr(_meta, 'modification_field', None)
+        self.routing_field = getattr(_meta, 'routing_field', None)
 
         # Add in fields from the model.
         self.fields.update(self._get_fields(fields, excludes, hotfixes))
         self.fields_to_fetch = list(set(self.fields.keys()).union(additional_fields))
+        if self.routing_field and self.routing_field not in self.fields_to_fetch:
+            self.fields_to_fetch.append(self.routing_field)
 
         # create the mapping instance
         self.mapping = getattr(_meta, 'mapping', Mapping(self.doc_type))
@@ -63,7 +81,7 @@ class ModelIndex(object):
 
             if cls_attr in self.fields:
                 overwrite_info = 'Overwriting implicitly defined model field {} ({}) its explicit definition: {}.'
-                logging.info(overwrite_info.format(cls_attr, unicode(self.fields[cls_attr]), unicode(obj)))
+                logging.info(overwrite_info.format(cls_attr, text_type(self.fields[cls_attr]), text_type(obj)))
 
             # check if override of a model_attr field and remove it for avoiding duplication (stay in fields_to_fetch)
             if hasattr(obj, '_model_attr') and obj._model_attr in self.fields:
@@ -73,12 +91,47 @@ class ModelIndex(object):
         for attr, value in iteritems(self.fields):
             self.mapping.field(attr, value)
 
+        # JSON key and type-specialized encoder of each field, computed once for `encode_object`
+        self._encoders = dict((name, (json_encode(name) + ':', getattr(field, 'encode', json_encode)))
+                              for name, field in iteritems(self.fields))
+        # definition of each field value, shared by the index instances of a model to serialize them only once
+        self._field_sources = dict((name, self._get_field_source(name, field))
+                                   for name, field in iteritems(self.fields))
+
         self.signal_processor = get_signal_processor()
         self.signal_processor.setup(self.model)
 
     def populate_index(self):
         return self.index
 
+    def get_index_name(self):
+        """
+        Resolves the index name with `populate_index`.
+        If `Meta.index_period` is set (in seconds), the name is computed at most once per period, periods being aligned
+        on the epoch in the current Django timezone (i.e. 86400 for daily indices starting at local midnight).
+        """
+        if not self.index_period:
+            return self.populate_index()
+
+        now = time.time()
+        if self._index_name is None or now >= self._index_name_expires:
+            self._index_name = self.populate_index()
+            # align periods on the wall clock of the timezone `populate_index` formats dates in
+            offset = datetime.fromtimestamp(now, timezone.get_current_timezone()).utcoffset().total_seconds()
+            self._index_name_expires = ((now + offset) // self.index_period + 1) * self.index_period - offset
+        return self._index_name
+
+    def get_index_template(self):
+        """
+        :return: a dictionary which can be used to generate the elasticsearch index template matching
+        `Meta.index_template`, so time-based indices are created with the mapping of this doctype.
+        """
+        return {
+            'template': self.index_template,
+            'mappings': self.mapping.to_dict(),
+            'settings': {'analysis': self.mapping._collect_analysis()},
+        }
+
     @staticmethod
     def matches_indexing_condition(item):
         """
@@ -86,6 +139,35 @@ class ModelIndex(object):
         """
         return True
 
+    def handle_bulk_errors(self, errors):
+        """
+        Called with the failed items of this doctype after a bulk request sent by `django_es.utils.flush_index`.
+        Raises a `BulkIndexError` by default.
+        """
+        raise BulkIndexError('%i document(s) of doctype %s failed to index.' % (len(errors), self.doc_type), errors)
+
+    def is_routed(self):
+        """
+        Returns whether the documents of this doctype carry a `_routing` value.
+        """
+        return bool(self.routing_field) or hasattr(self, 'prepare_routing')
+
+    def get_routing(self, obj):
+        """
+        Returns the `_routing` value of a document, computed by the `prepare_routing` method if defined, otherwise read
+        from the `Meta.routing_field` attribute. None if the documents of this doctype are not routed.
+        The routing of a document must not change, otherwise its former copy stays indexed on its former shard.
+        :param obj: object instance, as a dictionary or as a model instance.
+        """
+        if hasattr(self, 'prepare_routing'):
+            routing = self.prepare_routing(obj)
+        elif self.routing_field:
+            routing = obj[self.routing_field] if isinstance(obj, dict) else getattr(obj, self.routing_field)
+        else:
+            return None
+
+        return None if routing is None else text_type(routing)
+
     def get_model(self):
         return self.model
 
@@ -124,6 +206,90 @@ class ModelIndex(object):
 
         return serialized_object
 
+    def serialize_objects(self, objs, cache=None, compute=None):
+        """
+        Serializes a chunk of objects. Same as `serialize_object`, but fields defined by a `_template` are rendered for
+        the whole chunk at once, with one compiled template and one context.
+
+        :param objs: list of objects to be serialized.
+        :param cache: dictionary shared by the index instances serializing the same objects. Values are stored by field
+        definition (same `prepare_%s` method, `_template`, `_eval_as` or `_model_attr`), so a definition common to
+        several indices is evaluated once per object.
+        :param compute: function computing the values of a field for a list of objects, defaults to `compute_field`.
+        :return: A list of dictionaries representing the objects as defined in the mapping, in the same order.
+        """
+        if cache is None:
+            cache = {}
+        serialized_objects = [{} for _ in objs]
+
+        for name, field in iteritems(self.fields):
+            values = self.cache_field(name, field, objs, cache, compute)
+            for serialized_object, obj in zip(serialized_objects, objs):
+                serialized_object[name] = values[id(obj)]
+
+        return serialized_objects
+
+    def cache_field(self, name, field, objs, cache, compute=None):
+        """
+        Computes the values of a field for the objects whose value is not cached yet.
+
+        :param cache: dictionary of field values, cf. `serialize_objects`.
+        :param compute: function computing the values of a field for a list of objects, defaults to `compute_field`.
+        :return: the values of the field definition, by object id.
+        """
+        values = cache.setdefault(self._field_sources[name], {})
+        missing = [obj for obj in objs if id(obj) not in values]
+        if missing:
+            values.update(zip([id(obj) for obj in missing], (compute or self.compute_field)(name, field, missing)))
+        return values
+
+    def compute_field(self, name, field, objs):
+        """
+        Computes the values of a field for a chunk of objects.
+
+        :return: the list of values, in the order of the objects.
+        """
+        if hasattr(self, "prepare_%s" % name):
+            return [getattr(self, "prepare_%s" % name)(obj) for obj in objs]
+        if getattr(field, '_template_name', None):
+            return field.render_many(objs)
+        return [field.value(obj) for obj in objs]
+
+    def encode_object(self, obj, obj_pk=None, serialized_object=None):
+        """
+        Serializes an object and encodes it as a JSON document, using the encoder of each field type.
+
+        :param obj: Object to be serialized. Optional if obj_pk or serialized_object is passed.
+        :param obj_pk: Object primary key. Supersedded by `obj` if available.
+        :param serialized_object: Object already serialized by `serialize_object` or `serialize_objects`.
+        :return: A JSON string representing the object as defined in the mapping.
+        """
+        if serialized_object is None:
+            serialized_object = self.serialize_object(obj, obj_pk)
+        encoded = []
+
+        for name, value in iteritems(serialized_object):
+            key, encode = self._encoders[name]
+            encoded.append(key + encode(value))
+
+        return '{%s}' % ','.join(encoded)
+
+    def _get_field_source(self, name, field):
+        """
+        Returns a hashable definition of how the value of a field is computed.
+        """
+        if hasattr(self, "prepare_%s" % name):
+            method = getattr(self, "prepare_%s" % name)
+            # static methods resolve to plain functions
+            return 'prepare', name, getattr(method, '__func__', method)
+        if getattr(field, '_template_name', None):
+            return 'template', field._template_name
+        if getattr(field, '_eval_func', None):
+            return 'eval', field._eval_func
+        if getattr(field, '_model_attr', None):
+            return 'model_attr', field._model_attr
+        return 'field', id(field)
+
     def _get_fields(self, fields, excludes, hotfixes):
         """
         Given any explicit fields to include and fields to exclude, add
@@ -147,7 +313,7 @@ class ModelIndex(object):
                 continue
 
             # If field is a relation, skip.
-            if getattr(f, 'rel'):
+            if getattr(f, 'remote_field', None) or getattr(f, 'rel', None):
                 continue
 
             attr = {'_model_attr': f.name}
@@ -0,0 +1,25 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...mappings import mapping
+from ...profiler import profile_index
+
+
+class Command(BaseCommand):
+    help = 'Serializes a sample of the rows of a registered model without sending anything to elasticsearch, ' \
+           'and reports the database queries and time spent on each field, per document and for a full reindex.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Model to profile, as app_label.ModelName.')
+        parser.add_argument('--sample', type=int, default=100, help='Number of rows to serialize. Defaults to 100.')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if not mapping.is_registered(model):
+            raise CommandError('Model {} is not registered in django_es.'.format(options['model']))
+
+        self.stdout.write(profile_index(model, options['sample']).report())
@@ -24,17 +24,56 @@ class IndexMapping(object):
     """
 
     def __init__(self, name='django_es'):
-        self._registry = {}  # model_class class -> model_index_class instance
+        self._registry = {}  # model_class class -> list of model_index_class instances
         self.name = name
 
     def get_index(self, index, indice):
         if index is None:  # get last indexex
-            index = indice.indexes[-1:]
+            index = indice.indexes[-1]
         else:  # append it
             indice.indexes.append(index)
 
         return index
 
+    @staticmethod
+    def create_index(index, indice):
+        """
+        Creates the index on elasticsearch with the mapping of the given indice, and the index template if the indice
+        defines one.
+        :return: False if elasticsearch could not be reached, True otherwise.
+        """
+        try:
+            if indice.index_template:
+                es_instance.indices.put_template(name='{}-{}'.format(indice.index, indice.doc_type),
+                                                 body=indice.get_index_template())
+            # create mapping for model related to a doctype
+            es_instance.indices.create(index=index, body={
+                'mappings': indice.mapping.to_dict(),
+                'settings': {'analysis': indice.mapping._collect_analysis()}}, ignore=400)
+        except elasticsearch.exceptions.RequestError as exc:
+            raise Exception(
+                'You\'ve tried to update an existing mapping with same fields name, please visit' +
+                ' https://www.elastic.co/blog/changing-mapping-with-zero-downtime for more information.' +
+                ' Exception: ' + exc.info['error']['reason']
+            )
+        except elasticsearch.exceptions.ConnectionError:
+            logging.error('Cannot connect to elasticsearch instance, please verify your settings')
+            return False
+        return True
+
+    def resolve_index(self, indice):
+        """
+        Returns the current index name of the given indice.
+        A newly resolved index name is remembered by the indice. It is created on elasticsearch, unless an index
+        template already handles it.
+        """
+        index = indice.get_index_name()
+        if index not in indice.indexes:
+            if not indice.index_template:
+                self.create_index(index, indice)
+            indice.indexes.append(index)
+        return index
+
     def register(self, model_or_iterable=None, model_index_class=None, index=None):
         """
         Registers the given model(s) with the given model_index_class class.
@@ -45,7 +84,9 @@ class IndexMapping(object):
         indices). If keyword arguments are given -- e.g., list_display --
         they'll be applied as options to the model_index_class class.
 
-        If a model is already registered, this will raise AlreadyRegistered.
+        A model can be registered with several model_index_class classes, one per index or doc type.
+        If a model is already registered with the same model_index_class class, or with the same index and doc type,
+        this will raise AlreadyRegistered.
 
         If a model is abstract, this will raise ImproperlyConfigured.
         """
@@ -62,55 +103,27 @@ class IndexMapping(object):
             indice = model_index_class(model)
             index = self.get_index(index, indice)
 
-            if self.is_registered(model, index):
-                raise AlreadyRegistered('The model %s is already registered' % model.__name__)
+            for registered in self._registry.get(model, []):
+                if registered.__class__ is model_index_class or (index in registered.indexes and
+                                                                 registered.doc_type == indice.doc_type):
+                    raise AlreadyRegistered('The model %s is already registered with %s' % (
+                        model.__name__, registered.__class__.__name__))
 
             # Ignore the registration if the model has been
             # swapped out.
             if not model._meta.swapped:
-                try:
-                    # create mapping for model related to a doctype
-                    es_instance.indices.create(index=index, body={
-                        'mappings': indice.mapping.to_dict(),
-                        'settings': {'analysis': indice.mapping._collect_analysis()}}, ignore=400)
-                except elasticsearch.exceptions.RequestError as exc:
-                    raise Exception(
-                        'You\'ve tried to update an existing mapping with same fields name, please visit' +
-                        ' https://www.elastic.co/blog/changing-mapping-with-zero-downtime for more information.' +
-                        ' Exception: ' + exc.info['error']['reason']
-                    )
-                except elasticsearch.exceptions.ConnectionError:
-                    logging.error('Cannot connect to elasticsearch instance, please verify your settings')
-                    # register a model with its indice
-                    self._registry[model] = indice
-                else:
-                    # register a model with its indice
-                    self._registry[model] = indice
+                self.create_index(index, indice)
+                # register a model with its indice
+                self._registry.setdefault(model, []).append(indice)
 
         # classic mapping
         if not model_or_iterable:
             # TODO : check doctype does not already exist?
             indice = model_index_class()
             index = self.get_index(index, indice)
-            try:
-                es_instance.indices.create(index=index, body={
-                    'mappings': indice.mapping.to_dict(),
-                    'settings': {
-                        'analysis': indice.mapping._collect_analysis()}},
-                                       ignore=400)
-            except elasticsearch.exceptions.RequestError as exc:
-                    raise Exception(
-                        'You\'ve tried to update an existing mapping with same fields name, please visit' +
-                        ' https://www.elastic.co/blog/changing-mapping-with-zero-downtime for more information.' +
-                        ' Exception: ' + exc.info['error']['reason']
-                    )
-            except elasticsearch.exceptions.ConnectionError as exc:
-                logging.error('Cannot connect to elasticsearch instance, please verify your settings')
-                # register a model with its indice
-                self._registry[indice.doctype] = indice
-            else:
-                # register a model with its indice
-                self._registry[indice.doctype] = indice
+            self.create_index(index, indice)
+            # register a model with its indice
+            self._registry.setdefault(indice.doctype, []).append(indice)
 
     def unregister(self, model_or_iterable):
         """
@@ -129,11 +142,18 @@ class IndexMapping(object):
         """
         Check if a model class is registered with this `IndexMapping`.
         """
-        return model in self._registry and (index is None or index in self._registry[model].indexes)
+        return model in self._registry and (
+            index is None or any(index in indice.indexes for indice in self._registry[model]))
 
     def get_index_instance(self, model):
         """
-        Check if a model class is registered with this `IndexMapping`.
+        Returns the first model_index_class instance registered for a model class.
+        """
+        return self._registry[model][0]
+
+    def get_index_instances(self, model):
+        """
+        Returns all the model_index_class instances registered for a model class, in registration order.
         """
         return self._registry[model]
 
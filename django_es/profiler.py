@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from six import iteritems
+
+from .mappings import mapping
+
+__all__ = ['IndexProfile', 'profile_index']
+
+
+class IndexProfile(object):
+    """
+    Costs measured while serializing a sample of the rows of a model, as a reindex would, without sending anything to
+    elasticsearch. Each step is recorded with its number of database queries and its duration in seconds.
+    """
+
+    def __init__(self, model, sample_size, total):
+        self.model = model
+        self.sample_size = sample_size
+        self.total = total
+        self.steps = OrderedDict()  # (index, name, source) -> [queries, seconds]
+
+    def add(self, index, name, source, queries, seconds):
+        step = self.steps.setdefault((index, name, source), [0, 0.])
+        step[0] += queries
+        step[1] += seconds
+
+    @property
+    def queries(self):
+        return sum(queries for queries, _ in self.steps.values())
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.steps.values())
+
+    def per_document(self):
+        """
+        :return: a tuple (queries, seconds) of the average cost of a document.
+        """
+        if not self.sample_size:
+            return 0., 0.
+        return float(self.queries) / self.sample_size, self.seconds / self.sample_size
+
+    def projected(self):
+        """
+        :return: a tuple (queries, seconds) of the projected cost of reindexing all the rows of the model.
+        """
+        queries, seconds = self.per_document()
+        return queries * self.total, seconds * self.total
+
+    def report(self):
+        """
+        :return: the costs of each step and the totals, as a printable table.
+        """
+        lines = ['Profiled {} of {} {} objects, nothing was sent to elasticsearch.'.format(
+                 self.sample_size, self.total, self.model.__name__), '']
+        row = '{:<30} {:<20} {:<30} {:>9} {:>10} {:>10}'
+        lines.append(row.format('index', 'field', 'source', 'queries', 'q/doc', 'ms/doc'))
+
+        sample_size = self.sample_size or 1
+        steps = sorted(iteritems(self.steps), key=lambda step: step[1][1], reverse=True)
+        for (index, name, source), (queries, seconds) in steps:
+            lines.append(row.format(index, name, source, queries, '{:.2f}'.format(float(queries) / sample_size),
+                                    '{:.3f}'.format(seconds * 1000 / sample_size)))
+
+        queries, seconds = self.per_document()
+        lines.append('')
+        lines.append('Per document: {:.2f} queries, {:.3f} ms.'.format(queries, seconds * 1000))
+        queries, seconds = self.projected()
+        lines.append('Projected full reindex of {} documents: {:.0f} queries, {:.1f} s (serialization only).'.format(
+            self.total, queries, seconds))
+        return '\n'.join(lines)
+
+
+def _describe_source(source):
+    kind = source[0]
+    if kind == 'prepare':
+        return 'prepare_{}'.format(source[1])
+    if kind == 'template':
+        return '_template={}'.format(source[1])
+    if kind == 'eval':
+        return '_eval_as'
+    if kind == 'model_attr':
+        return '_model_attr={}'.format(source[1])
+    return kind
+
+
+def profile_index(model, sample_size=100, queryset=None):
+    """
+    Serializes and encodes a sample of the rows of a model, for each index instance registered for it, attributing
+    database queries and time to each field. Fields sharing a definition across index instances are computed once, as
+    during a reindex.
+    :param model: Model whose index instances are profiled.
+    :param sample_size: number of rows to serialize. Defaults to 100.
+    :param queryset: queryset the sample is taken from, e.g. to profile a `select_related` or `prefetch_related`
+    variant. Defaults to all the rows of the model, ordered by primary key.
+    :return: an `IndexProfile`.
+    """
+    if queryset is None:
+        queryset = model.objects.order_by('pk')
+    connection = connections[queryset.db]
+    total = queryset.count()
+
+    def measure(func, *args):
+        with CaptureQueriesContext(connection) as captured:
+            start = default_timer()
+            result = func(*args)
+            seconds = default_timer() - start
+        return result, len(captured), seconds
+
+    objs, queries, seconds = measure(list, queryset[:sample_size])
+    profile = IndexProfile(model, len(objs), total)
+    profile.add('', 'fetch', 'queryset', queries, seconds)
+
+    cache = {}
+    for index_instance in mapping.get_index_instances(model):
+        index = '{}.{}'.format(index_instance.get_index_name(), index_instance.doc_type)
+        docs, queries, seconds = measure(lambda: [doc for doc in objs
+                                                  if index_instance.matches_indexing_condition(doc)])
+        profile.add(index, 'condition', 'matches_indexing_condition', queries, seconds)
+
+        def compute(name, field, objs):
+            computed, queries, seconds = measure(index_instance.compute_field, name, field, objs)
+            profile.add(index, name, _describe_source(index_instance._field_sources[name]), queries, seconds)
+            return computed
+
+        # fields already computed for a previous index instance are listed at no cost
+        for name in index_instance.fields:
+            profile.add(index, name, _describe_source(index_instance._field_sources[name]), 0, 0.)
+        serialized_objects = index_instance.serialize_objects(docs, cache, compute)
+        _, queries, seconds = measure(lambda: [index_instance.encode_object(doc, serialized_object=serialized_object)
+                                               for doc, serialized_object in zip(docs, serialized_objects)])
+        profile.add(index, 'encode', 'json', queries, seconds)
+
+        _, queries, seconds = measure(lambda: [index_instance.get_routing(doc) for doc in docs])
+        profile.add(index, 'routing', 'get_routing', queries, seconds)
+
+    return profile
@@ -0,0 +1,111 @@
+from multiprocessing.pool import ThreadPool
+
+from django.db.models.base import ModelBase
+from elasticsearch_dsl import MultiSearch, Search
+
+from django_es import es_instance
+from .mappings import mapping
+
+__all__ = ['SearchBatch']
+
+
+class SearchBatch(object):
+    """
+    Collects independent searches and executes them as `_msearch` requests instead of one request per search.
+    Searches can be keyed by a registered model (or doc type), in which case they target the index and doc type of
+    its ModelIndex.
+
+    Example:
+
+        batch = SearchBatch()
+        lives = batch.add(Search().suggest('lives', searchstr, completion={'field': 'suggest'}), MyModel)
+        count = batch.add(Search().query('match', name=searchstr)[:0], MyModel)
+        responses = batch.execute()
+        responses[lives].suggest.lives
+    """
+
+    def __init__(self, using=None, batch_size=None, concurrency=1, index_mapping=None):
+        """
+        :param using: elasticsearch client, defaults to `es_instance`.
+        :param batch_size: maximum number of searches per `_msearch` request. Defaults to None, a single request.
+        :param concurrency: number of `_msearch` requests sent concurrently when searches are split. Defaults to 1.
+        :param index_mapping: `IndexMapping` the models are registered with, defaults to the django_es mapping.
+        """
+        self.using = using or es_instance
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.mapping = index_mapping or mapping
+        self._searches = []
+
+    def __len__(self):
+        return len(self._searches)
+
+    def search(self, model=None, routing=None):
+        """
+        :return: a new `Search`, bound to the index and doc type of the given model if any, and to the shard of the
+        given routing value if any.
+        """
+        s = Search(using=self.using)
+        if model is not None:
+            s = self._bind(s, model)
+        if routing is not None:
+            s = s.params(routing=routing)
+        return s
+
+    def _bind(self, search, model):
+        if isinstance(model, ModelBase):
+            indice = self.mapping.get_index_instance(model)
+        else:
+            indices = [indice for registered in self.mapping._registry.values() for indice in registered
+                       if indice.doc_type == model]
+            if not indices:
+                raise KeyError('No ModelIndex registered with doc type {}.'.format(model))
+            indice = indices[0]
+
+        # time-based indices are searched through their template pattern
+        return search.index(indice.index_template or indice.get_index_name()).doc_type(indice.doc_type)
+
+    def add(self, search, model=None, routing=None):
+        """
+        Adds a search to the batch.
+        :param search: the `Search` to execute.
+        :param model: model class, or doc type, whose index and doc type the search must target. Optional.
+        :param routing: routing value restricting the search to the shard of the routed documents. Optional.
+        :return: the position of the search response in the list returned by `execute`.
+        """
+        if model is not None:
+            search = self._bind(search, model)
+        if routing is not None:
+            search = search.params(routing=routing)
+        self._searches.append(search)
+        return len(self._searches) - 1
+
+    def _execute_chunk(self, searches, raise_on_error):
+        ms = MultiSearch(using=self.using)
+        for s in searches:
+            ms = ms.add(s)
+        return ms.execute(raise_on_error=raise_on_error)
+
+    def execute(self, raise_on_error=True):
+        """
+        Sends the collected searches, split in requests of at most `batch_size` searches.
+        :param raise_on_error: raise a `TransportError` if one of the searches failed, otherwise its response is None.
+        :return: the list of `Response`, in the order the searches were added.
+        """
+        if not self._searches:
+            return []
+
+        size = self.batch_size or len(self._searches)
+        chunks = [self._searches[i:i + size] for i in range(0, len(self._searches), size)]
+
+        if self.concurrency > 1 and len(chunks) > 1:
+            pool = ThreadPool(min(self.concurrency, len(chunks)))
+            try:
+                results = pool.map(lambda chunk: self._execute_chunk(chunk, raise_on_error), chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._execute_chunk(chunk, raise_on_error) for chunk in chunks]
+
+        return [response for chunk_responses in results for response in chunk_responses]
@@ -1,5 +1,6 @@
-from base import *
-from has_changed import *
+from .base import *
+from .has_changed import *
+from .documents import index_updated
 from importlib import import_module
 
 __author__ = 'guillaume'
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+from django.conf import settings
+
+__all__ = ['IndexBuffer']
+
+
+class IndexBuffer(object):
+    """
+    Buffer of the items waiting to be indexed, shared by all models.
+
+    Only (model, primary key) entries are kept, not the instances and their cached related objects, so memory stays
+    bounded by the number of entries and rows are fresh when indexed: on flush, rows are re-fetched with one query per
+    model. The buffer is full when it holds `BUFFER_SIZE` items (defaults to 100).
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()  # model -> OrderedDict of pk -> None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, model, pk):
+        pks = self._entries.setdefault(model, OrderedDict())
+        if pk in pks:
+            return
+        pks[pk] = None
+        self.size += 1
+
+    def discard(self, model, pk):
+        pks = self._entries.get(model)
+        if pks and pk in pks:
+            del pks[pk]
+            self.size -= 1
+
+    def is_full(self):
+        buffer_size = 100
+        if hasattr(settings, 'DJANGO_ES'):
+            buffer_size = settings.DJANGO_ES.get('BUFFER_SIZE', buffer_size)
+
+        return self.size >= buffer_size
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def flush(self):
+        """
+        Re-fetches the buffered rows, one query per model, and indexes them in a single bulk request.
+        Rows deleted in the meantime are skipped.
+        """
+        from ..utils import flush_index
+
+        model_items = OrderedDict()
+        for model, pks in self._entries.items():
+            if pks:
+                model_items[model] = list(model.objects.filter(pk__in=list(pks)))
+
+        try:
+            flush_index(model_items)
+        finally:
+            # Let's now empty this buffer or we'll end up reindexing every item which was previously buffered, failed
+            # items included: they are handed to `handle_bulk_errors`.
+            self.clear()
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent once documents of a doctype have been written to an index, with `doc_type` and `index` arguments.
+# The sender is the ModelIndex class of the doctype.
+index_updated = Signal()
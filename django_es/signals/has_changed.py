@@ -1,9 +1,8 @@
-from django.conf import settings
-from _collections import defaultdict
-
 from django.db.models import signals
 
-__items_to_be_indexed__ = defaultdict(list)
+from .buffer import IndexBuffer
+
+__items_to_be_indexed__ = IndexBuffer()
 
 
 class HasChangedDjangoESSignalProcessor(object):
@@ -25,22 +24,18 @@ class HasChangedDjangoESSignalProcessor(object):
         :return:
         """
 
-        from ..utils import update_index
         if created or instance.has_changed('name'):
-            buffer_size = 100
-            if hasattr(settings, 'DJANGO_ES') and 'BUFFER_SIZE' in settings.DJANGO_ES:
-                buffer_size = settings.DJANGO_ES['BUFFER_SIZE']
-
-            __items_to_be_indexed__[sender].append(instance)
+            # only the primary key is buffered, the row is fetched again when the buffer is flushed
+            __items_to_be_indexed__.add(sender, instance.pk)
 
-            if len(__items_to_be_indexed__[sender]) >= buffer_size:
-                update_index(__items_to_be_indexed__[sender], sender, bulk_size=buffer_size)
-                # Let's now empty this buffer or we'll end up reindexing every item which was previously buffered.
-                __items_to_be_indexed__[sender] = []
+            # the buffer is shared by all models, and flushed as a single bulk request
+            if __items_to_be_indexed__.is_full():
+                __items_to_be_indexed__.flush()
 
     @staticmethod
     def pre_delete_connector(sender, instance, **kwargs):
         from ..utils import delete_index_item
+        __items_to_be_indexed__.discard(sender, instance.pk)
         delete_index_item(instance, sender)
 
     def setup(self, model):
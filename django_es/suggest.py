@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.db.models.base import ModelBase
+from elasticsearch_dsl.utils import AttrList
+
+from .mappings import mapping
+from .search import SearchBatch
+from .signals.documents import index_updated
+
+__all__ = ['SuggestionCache']
+
+
+class SuggestionCache(object):
+    """
+    In-process LRU cache of completion suggestions for the documents of a registered model.
+
+    Hot prefixes are answered without leaving the process. The cache can be warmed from real query logs with `warm`,
+    and is cleared whenever documents of the doc type are written through django_es in the same process
+    (`index_updated` signal). Writes made by other processes are only seen once entries expire, after `max_age`.
+
+    Example:
+
+        suggestions = SuggestionCache(MyModel, field='suggest', size=5, fuzzy=True, context={'type': 'mymodel'})
+        suggestions.warm(line.strip() for line in open('autocomplete.log'))
+        options = suggestions.suggest(searchstr)
+    """
+
+    def __init__(self, model, field='suggest', size=5, max_entries=5000, max_age=300, using=None, **completion):
+        """
+        :param model: model class, or doc type, whose documents hold the completion field.
+        :param field: name of the completion field. Defaults to `suggest`.
+        :param size: number of suggestions per prefix. Defaults to 5.
+        :param max_entries: maximum number of cached prefixes, the least recently used ones are evicted.
+        :param max_age: number of seconds after which a cached prefix is fetched again. Defaults to 300, None never
+        expires entries.
+        :param using: elasticsearch client, defaults to `es_instance`.
+        :param completion: other parameters of the completion suggester, such as `fuzzy` or `context`.
+        """
+        self.model = model
+        self.field = field
+        self.size = size
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.using = using
+        self.completion = completion
+        self._entries = OrderedDict()  # prefix -> (options, expiry time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # bumped by each invalidation, so options fetched before it are not cached
+        self._generation = 0
+
+        self._batch = SearchBatch(using=using)
+        self.doc_type = mapping.get_index_instance(model).doc_type if isinstance(model, ModelBase) else model
+        index_updated.connect(self._index_updated)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(prefix):
+        return ' '.join(prefix.lower().split())
+
+    def _search(self, prefix):
+        completion = dict(self.completion, field=self.field, size=self.size)
+        return self._batch.search(self.model).suggest('suggestions', prefix, completion=completion)[:0]
+
+    @staticmethod
+    def _options(response):
+        suggestions = response.to_dict().get('suggest', {}).get('suggestions', [])
+        return AttrList(suggestions[0]['options'] if suggestions else [])
+
+    def _store(self, prefix, options, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            # (re-)insert it as the most recently used entry
+            self._entries.pop(prefix, None)
+            self._entries[prefix] = options, None if self.max_age is None else time.time() + self.max_age
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def suggest(self, prefix):
+        """
+        :return: the list of completion options (with `text`, `_score` and `payload`) for the prefix, as in
+        `response.suggest.<name>[0]['options']`, from the cache if possible.
+        """
+        prefix = self.normalize(prefix)
+        with self._lock:
+            entry = self._entries.pop(prefix, None)
+            if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                self._entries[prefix] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        options = self._options(self._search(prefix).execute())
+        self._store(prefix, options, generation)
+        return options
+
+    def warm(self, queries, batch_size=100):
+        """
+        Fetches the suggestions of the most frequent prefixes of the given queries, with `_msearch` requests.
+        :param queries: iterable of queries typed by users, e.g. read from query logs. Each query contributes all its
+        prefixes.
+        :param batch_size: number of prefixes per `_msearch` request. Defaults to 100.
+        :return: the number of prefixes fetched.
+        """
+        counts = Counter()
+        for query in queries:
+            query = self.normalize(query)
+            for i in range(1, len(query) + 1):
+                counts[query[:i]] += 1
+
+        prefixes = [prefix for prefix, _ in counts.most_common(self.max_entries)]
+        for start in range(0, len(prefixes), batch_size):
+            chunk = prefixes[start:start + batch_size]
+            batch = SearchBatch(using=self.using)
+            for prefix in chunk:
+                batch.add(self._search(prefix))
+            generation = self._generation
+            for prefix, response in zip(chunk, batch.execute()):
+                self._store(prefix, self._options(response), generation)
+
+        return len(prefixes)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _index_updated(self, sender, doc_type, **kwargs):
+        if doc_type == self.doc_type:
+            self.invalidate()
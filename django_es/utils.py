@@ -1,27 +1,39 @@
 import logging
+import sys
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Model
+from django.utils import timezone
 from elasticsearch.exceptions import NotFoundError
+from six import iteritems, reraise
 from django_es import es_instance
+from .bulk import BulkBody, bulk_ndjson
 from .mappings import mapping
+from .signals.documents import index_updated
+from .watermarks import get_watermark_store
 
-from elasticsearch.helpers import bulk
 
-
-def update_index(model_items, model, action='index', bulk_size=100, num_docs=-1, refresh=True):
+def update_index(model_items, model, action='index', bulk_size=100, num_docs=-1, refresh=True, compress=None):
     """
     Updates the index for the provided model_items.
     :param model_items: a list of model_items (django Model instances, or proxy instances) which are to be
     indexed/updated or deleted.
-    If action is 'index', the model_items must be serializable objects. If action is 'delete', the model_items must be
-    primary keys corresponding to objects in the index.
-    :param model: Model that will get the index index instance related (i.e indice).
-    :param action: the action that you'd like to perform on this group of data. Must be in ('index', 'delete') and
-    defaults to 'index.'
+    If action is 'index' or 'update', the model_items must be serializable objects. If action is 'delete', the
+    model_items must be primary keys corresponding to objects in the index, or model instances, which are required
+    when documents are routed (ValueError is raised otherwise).
+    :param model: Model that will get the index index instances related (i.e indices). Items are serialized once and
+    sent to every index of the model in the same bulk requests.
+    :param action: the action that you'd like to perform on this group of data. Must be in ('index', 'update', 'delete')
+    and defaults to 'index.'
     :param bulk_size: bulk size for indexing. Defaults to 100.
     :param num_docs: maximum number of model_items from the provided list to be indexed.
     :param refresh: a boolean that determines whether to refresh the index, making all operations performed since the
     last refresh
     immediately available for search, instead of needing to wait for the scheduled Elasticsearch execution. Defaults to
     True.
+    :param compress: a boolean that determines whether bulk bodies are gzip compressed. Defaults to the
+    `BULK_COMPRESS` setting of `DJANGO_ES`, or False.
 
     :note: If model_items contain multiple models, then num_docs is applied to *each* model. For example, if bulk_size
     is set to 5, and item contains models Article and Article2, then 5 model_items of Article *and* 5 model_items of
@@ -30,14 +42,11 @@ def update_index(model_items, model, action='index', bulk_size=100, num_docs=-1,
     if action == 'delete' and not hasattr(model_items, '__iter__'):
         raise ValueError("If action is 'delete', model_items must be an iterable of primary keys.")
 
-    logging.info('Getting index for model {}.'.format(model.__name__))
+    logging.info('Getting indices for model {}.'.format(model.__name__))
 
-    index_instance = mapping.get_index_instance(model)
-
-    # if the last indexes not equal to the populated index, recreate index, before change
-    index_name = index_instance.populate_index()
-    if index_name not in index_instance.indexes:
-        mapping.register(model, index_instance.__class__, index_name)
+    resolved = [(index_instance, mapping.resolve_index(index_instance))
+                for index_instance in mapping.get_index_instances(model)]
+    index_name = ','.join(sorted(set(name for _, name in resolved)))
 
     if num_docs == -1:
         if isinstance(model_items, (list, tuple)):
@@ -48,65 +57,244 @@ def update_index(model_items, model, action='index', bulk_size=100, num_docs=-1,
         logging.warning('Limiting the number of model_items to {} to {}.'.format(action, num_docs))
 
     logging.info('{} {} documents on index {}'.format(action, num_docs, index_name))
+    body = BulkBody(compress=_get_compress(compress))
+    # index instances and index names actually written to, indices handled by a template may not exist yet
+    targets = set()
     prev_step = 0
     max_docs = num_docs + bulk_size if num_docs > bulk_size else bulk_size + 1
     for next_step in range(bulk_size, max_docs, bulk_size):
         logging.info('{}: documents {} to {} of {} total on index {}.'.format(action.capitalize(), prev_step, next_step,
                                                                               num_docs, index_name))
-        data = create_indexed_document(index_instance, model_items[prev_step:next_step], action)
-        bulk(es_instance, data, index=index_name, doc_type=index_instance.doc_type, raise_on_error=True)
+        targets.update(create_model_bulk_body(model, model_items[prev_step:next_step], action, body))
+        bulk_ndjson(body, raise_on_error=True)
+        body.reset()
         prev_step = next_step
 
-    if refresh:
-        es_instance.indices.refresh(index=index_name)
+    if refresh and targets:
+        es_instance.indices.refresh(index=','.join(sorted(set(name for _, name in targets))))
+
+    for index_instance, name in targets:
+        _send_index_updated(index_instance, [name])
+
+
+def update_index_since(model, bulk_size=100, refresh=True, compress=None, store=None, lag=None):
+    """
+    Incrementally updates the indices of a model whose ModelIndex defines a `modification_field` in its Meta.
+    Only the rows modified since the watermark of each index are streamed from the database and indexed. Once all of
+    them are indexed, the watermark is advanced to the start of the run minus a safety lag, so an interrupted run is
+    simply replayed, and rows stamped before the start of the run but committed after it are indexed by the next run.
+    :param model: Model that will get the index index instances related (i.e indices).
+    :param bulk_size: bulk size for indexing. Defaults to 100.
+    :param refresh: a boolean that determines whether to refresh the index once the run is over. Defaults to True.
+    :param compress: a boolean that determines whether bulk bodies are gzip compressed. Defaults to the
+    `BULK_COMPRESS` setting of `DJANGO_ES`, or False.
+    :param store: the watermark store, defaults to the `WATERMARK_STORE` setting of `DJANGO_ES`, or an
+    `ESWatermarkStore`.
+    :param lag: number of seconds re-scanned by the next run, which should exceed the duration of the longest
+    transaction writing the model. Defaults to the `WATERMARK_LAG` setting of `DJANGO_ES`, or 300.
+    """
+    store = store or get_watermark_store()
+    if lag is None:
+        lag = settings.DJANGO_ES.get('WATERMARK_LAG', 300) if hasattr(settings, 'DJANGO_ES') else 300
+
+    for index_instance in mapping.get_index_instances(model):
+        field = index_instance.modification_field
+        if not field:
+            logging.info('{} does not define a modification_field, skipping.'.format(index_instance))
+            continue
+
+        key = '{}.{}'.format(index_instance.index, index_instance.doc_type)
+        since = store.get(key)
+        until = timezone.now()
+
+        model_items = model.objects.filter(**{'{}__lte'.format(field): until})
+        if since is not None:
+            model_items = model_items.filter(**{'{}__gt'.format(field): since})
+        model_items = model_items.order_by(field, 'pk')
+
+        index_name = mapping.resolve_index(index_instance)
+        logging.info('Indexing {} documents modified since {} on index {}.'.format(model.__name__, since, index_name))
+        body = BulkBody(compress=_get_compress(compress))
+        written = 0
+        chunk = []
+        for item in model_items.iterator():
+            chunk.append(item)
+            if len(chunk) >= bulk_size:
+                create_bulk_body(index_instance, chunk, 'index', index_name, body)
+                written += len(body)
+                bulk_ndjson(body, raise_on_error=True)
+                body.reset()
+                chunk = []
+        if chunk:
+            create_bulk_body(index_instance, chunk, 'index', index_name, body)
+            written += len(body)
+            bulk_ndjson(body, raise_on_error=True)
+
+        if refresh and written:
+            es_instance.indices.refresh(index=index_name)
+
+        # the watermark never moves backwards, runs closer than the lag re-scan the same rows
+        watermark = until - timedelta(seconds=lag)
+        if since is not None and watermark < since:
+            watermark = since
+        store.set(key, watermark, previous=since)
+        _send_index_updated(index_instance, [index_name])
+
+
+def flush_index(model_items, action='index', refresh=True, compress=None):
+    """
+    Updates the index of several models with a single bulk request, followed by a single refresh.
+    Each action carries its own `_index` and `_type`. Failed items are then handed back to the `handle_bulk_errors`
+    method of the index instance of their model.
+    :param model_items: a dictionary of model -> list of model_items to be indexed/updated or deleted.
+    :param action: the action that you'd like to perform on this group of data. Must be in ('index', 'delete') and
+    defaults to 'index.'
+    :param refresh: a boolean that determines whether to refresh the indices touched by the request. Defaults to True.
+    :param compress: a boolean that determines whether the bulk body is gzip compressed. Defaults to the
+    `BULK_COMPRESS` setting of `DJANGO_ES`, or False.
+    """
+    body = BulkBody(compress=_get_compress(compress))
+    # index instance and index name related to each action of the body, in order
+    targets = []
+
+    for model, items in iteritems(model_items):
+        if items:
+            targets.extend(create_model_bulk_body(model, items, action, body))
+    index_names = set(index_name for _, index_name in targets)
+
+    logging.info('{} {} documents of {} models in a single bulk request.'.format(action, len(body), len(model_items)))
+    results = bulk_ndjson(body, raise_on_error=False)
+
+    if refresh and index_names:
+        es_instance.indices.refresh(index=','.join(sorted(index_names)))
+
+    updated = defaultdict(set)
+    for index_instance, index_name in targets:
+        updated[index_instance].add(index_name)
+    for index_instance, names in iteritems(updated):
+        _send_index_updated(index_instance, names)
+
+    errors = defaultdict(list)
+    for (index_instance, _), (ok, item) in zip(targets, results):
+        if not ok:
+            errors[index_instance].append(item)
+
+    # every handler is called, the first exception raised by one of them is re-raised afterwards
+    exc_info = None
+    for index_instance, items in iteritems(errors):
+        try:
+            index_instance.handle_bulk_errors(items)
+        except Exception:
+            if exc_info is None:
+                exc_info = sys.exc_info()
+    if exc_info is not None:
+        reraise(*exc_info)
 
 
 def delete_index_item(item, model, refresh=True):
     """
-    Deletes an item from the index.
+    Deletes an item from the indices of its model.
     :param item: must be a serializable object.
-    :param model: Model that will get the index index instance related (indice).
+    :param model: Model that will get the index index instances related (indices).
     :param refresh: a boolean that determines whether to refresh the index, making all operations performed since the
     last refresh immediately available for search, instead of needing to wait for the scheduled Elasticsearch execution.
     Defaults to True.
     """
 
-    logging.info('Getting index for model {}.'.format(model.__name__))
+    logging.info('Getting indices for model {}.'.format(model.__name__))
 
-    index_instance = mapping.get_index_instance(model)
-    # if the last indexes not equal to the populated index, recreate index, before change
-    index_name = index_instance.populate_index()
-    if index_name not in index_instance.indexes:
-        mapping.register(model, index_instance.__class__, index_name)
+    resolved = []
+    for index_instance in mapping.get_index_instances(model):
+        index_name = mapping.resolve_index(index_instance)
+        resolved.append((index_instance, index_name))
 
-    item_es_id = getattr(item, index_instance.id_field)
-    try:
-        es_instance.delete(index_name, index_instance.doc_type, item_es_id)
-    except NotFoundError as e:
-        logging.warning(
-            'NotFoundError: could not delete {}.{} from index {}: {}.'.format(model.__name__, item_es_id, index_name,
-                                                                              str(e)))
+        item_es_id = getattr(item, index_instance.id_field)
+        try:
+            es_instance.delete(index_name, index_instance.doc_type, item_es_id,
+                               routing=index_instance.get_routing(item))
+        except NotFoundError as e:
+            logging.warning(
+                'NotFoundError: could not delete {}.{} from index {}: {}.'.format(model.__name__, item_es_id,
+                                                                                  index_name, str(e)))
 
     if refresh:
-        es_instance.indices.refresh(index=index_name)
+        # the index of the current period may not exist yet when it is created by a template on first write
+        es_instance.indices.refresh(index=','.join(sorted(set(name for _, name in resolved))), ignore_unavailable=True)
 
+    for index_instance, index_name in resolved:
+        _send_index_updated(index_instance, [index_name])
 
-def create_indexed_document(index_instance, model_items, action):
+
+def create_bulk_body(index_instance, model_items, action, index_name, body=None, cache=None):
     """
-    Creates the document that will be passed into the bulk index function.
-    Either a list of serialized objects to index, or a a dictionary specifying the primary keys of items to be delete.
+    Encodes the bulk actions of model items straight into a `BulkBody`, using the type-specialized encoders of the
+    index fields. Items are serialized documents to index, or primary keys of items to delete.
+    :param body: `BulkBody` to append the actions to, a new one is created if not provided.
+    :param cache: field values cache shared with other index instances of the model, cf. `ModelIndex.serialize_objects`.
+    :return: the `BulkBody`.
     """
-    data = []
+    if body is None:
+        body = BulkBody()
+
     if action == 'delete':
-        for pk in model_items:
-            data.append({'_id': str(pk), '_op_type': action})
+        for item in model_items:
+            metadata = {'_index': index_name, '_type': index_instance.doc_type}
+            # routed documents can only be deleted from model instances, which know their routing
+            if isinstance(item, Model):
+                metadata['_id'] = str(getattr(item, index_instance.id_field))
+                routing = index_instance.get_routing(item)
+                if routing is not None:
+                    metadata['_routing'] = routing
+            elif index_instance.is_routed():
+                raise ValueError('Documents of {} are routed, they must be deleted from model instances rather than '
+                                 'primary keys.'.format(index_instance))
+            else:
+                metadata['_id'] = str(item)
+            body.add(action, metadata)
     else:
-        for doc in model_items:
-            if index_instance.matches_indexing_condition(doc):
-                d = index_instance.serialize_object(doc)
-                pk = getattr(doc, index_instance.id_field)
-                # if working with post save signal, we know the correct pk field
-                if pk is not None:
-                    d['_id'] = str(pk)
-                data.append(d)
-    return data
+        docs = [doc for doc in model_items if index_instance.matches_indexing_condition(doc)]
+        for doc, serialized_object in zip(docs, index_instance.serialize_objects(docs, cache)):
+            metadata = {'_index': index_name, '_type': index_instance.doc_type}
+            pk = getattr(doc, index_instance.id_field)
+            # if working with post save signal, we know the correct pk field
+            if pk is not None:
+                metadata['_id'] = str(pk)
+            routing = index_instance.get_routing(doc)
+            if routing is not None:
+                metadata['_routing'] = routing
+            source = index_instance.encode_object(doc, serialized_object=serialized_object)
+            if action == 'update':
+                # partial update of the indexed fields
+                source = '{"doc":%s}' % source
+            body.add(action, metadata, source)
+    return body
+
+
+def create_model_bulk_body(model, model_items, action, body):
+    """
+    Appends the actions of the provided model_items to a `BulkBody`, for every index instance registered for the model.
+    Each item is serialized once, field values being shared by the index instances which define them the same way.
+    :return: the list of (index instance, index name) tuples related to each action appended, in order.
+    """
+    model_items = list(model_items)
+    cache = {}
+    targets = []
+
+    for index_instance in mapping.get_index_instances(model):
+        index_name = mapping.resolve_index(index_instance)
+        count = len(body)
+        create_bulk_body(index_instance, model_items, action, index_name, body, cache)
+        targets.extend([(index_instance, index_name)] * (len(body) - count))
+
+    return targets
+
+
+def _send_index_updated(index_instance, index_names):
+    for index_name in sorted(index_names):
+        index_updated.send(sender=index_instance.__class__, doc_type=index_instance.doc_type, index=index_name)
+
+
+def _get_compress(compress):
+    if compress is None:
+        return hasattr(settings, 'DJANGO_ES') and settings.DJANGO_ES.get('BULK_COMPRESS', False)
+    return compress
@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from importlib import import_module
+
+from dateutil import parser
+from django.conf import settings
+from elasticsearch.exceptions import ConflictError
+
+from django_es import es_instance
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+__all__ = ['WatermarkConflict', 'LocalWatermarkStore', 'ESWatermarkStore', 'get_watermark_store']
+
+
+class WatermarkConflict(Exception):
+    pass
+
+
+class LocalWatermarkStore(object):
+    """
+    Stores watermarks in a local JSON file, replaced atomically on each update. Updates are serialized by an exclusive
+    lock on a `.lock` file next to it.
+    The path is defined by the `WATERMARK_PATH` setting of `DJANGO_ES`, defaults to `django_es_watermarks.json`.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = 'django_es_watermarks.json'
+            if hasattr(settings, 'DJANGO_ES') and 'WATERMARK_PATH' in settings.DJANGO_ES:
+                path = settings.DJANGO_ES['WATERMARK_PATH']
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+
+    @contextmanager
+    def _lock(self):
+        with open(self.path + '.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def get(self, key):
+        value = self._load().get(key)
+        return parser.parse(value) if value else None
+
+    def set(self, key, value, previous=None):
+        """
+        Advances the watermark of `key` to `value`.
+        Raises WatermarkConflict if the stored watermark is no longer `previous`.
+        """
+        with self._lock():
+            watermarks = self._load()
+            stored = watermarks.get(key)
+            if (parser.parse(stored) if stored else None) != previous:
+                raise WatermarkConflict('Watermark {} has been moved to {} by another run.'.format(key, stored))
+
+            watermarks[key] = value.isoformat()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(watermarks, f)
+            os.rename(tmp_path, self.path)
+
+
+class ESWatermarkStore(object):
+    """
+    Stores watermarks as documents of an elasticsearch index, updated with optimistic concurrency control.
+    The index is defined by the `WATERMARK_INDEX` setting of `DJANGO_ES`, defaults to `django_es_watermarks`.
+    """
+    doc_type = 'watermark'
+
+    def __init__(self, index=None, client=None):
+        if index is None:
+            index = 'django_es_watermarks'
+            if hasattr(settings, 'DJANGO_ES') and 'WATERMARK_INDEX' in settings.DJANGO_ES:
+                index = settings.DJANGO_ES['WATERMARK_INDEX']
+        self.index = index
+        self.client = client or es_instance
+
+    def _load(self, key):
+        doc = self.client.get(index=self.index, doc_type=self.doc_type, id=key, ignore=404)
+        if not doc.get('found'):
+            return None, None
+        return parser.parse(doc['_source']['value']), doc['_version']
+
+    def get(self, key):
+        return self._load(key)[0]
+
+    def set(self, key, value, previous=None):
+        """
+        Advances the watermark of `key` to `value`.
+        Raises WatermarkConflict if the stored watermark is no longer `previous`.
+        """
+        stored, version = self._load(key)
+        if stored != previous:
+            raise WatermarkConflict('Watermark {} has been moved to {} by another run.'.format(key, stored))
+
+        body = {'value': value.isoformat()}
+        try:
+            if version is None:
+                self.client.create(index=self.index, doc_type=self.doc_type, id=key, body=body)
+            else:
+                self.client.index(index=self.index, doc_type=self.doc_type, id=key, body=body, version=version)
+        except ConflictError:
+            raise WatermarkConflict('Watermark {} has been moved by another run.'.format(key))
+
+
+def get_watermark_store():
+
+    if hasattr(settings, 'DJANGO_ES') and 'WATERMARK_STORE' in settings.DJANGO_ES:
+        store_path = settings.DJANGO_ES['WATERMARK_STORE'].split('.')
+        store_module = import_module('.'.join(store_path[:-1]))
+        store_class = getattr(store_module, store_path[-1])
+    else:
+        store_class = ESWatermarkStore
+    return store_class()